@@ -16,26 +16,36 @@ def load_hdf5_frame(hdf5_file_path, dataset_name, frame_index):
     return mask_data
 
 
-def load_mov_frame(mov_file_path, frame_index):
-    cap = cv2.VideoCapture(mov_file_path)
+def load_mov_frame(cap, frame_index):
+    """
+    Reads a grayscale frame from an open `cv2.VideoCapture`. Taking the capture rather than a path
+    lets callers that read several frames reuse it instead of re-opening the MOV file each time.
+    """
     cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
     ret, frame = cap.read()
-    cap.release()
     if ret:
         return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     else:
-        print(f"Could not read frame {frame_index} from {mov_file_path}.")
         return None
 
 
 def compare_frames(hdf5_file_path, mov_file_path, output_file, dataset_name, frame_index):
     hdf5_frame = load_hdf5_frame(hdf5_file_path, dataset_name, frame_index)
-    mov_frame = load_mov_frame(mov_file_path, frame_index)
+
+    cap = cv2.VideoCapture(mov_file_path)
+    try:
+        mov_frame = load_mov_frame(cap, frame_index)
+    finally:
+        cap.release()
+    if mov_frame is None:
+        print(f"Could not read frame {frame_index} from {mov_file_path}.")
 
     if hdf5_frame is not None and mov_frame is not None:
-        # Normalize the frames to the same range for proper comparison if needed
-        hdf5_frame = (hdf5_frame / np.max(hdf5_frame) * 255).astype(np.uint8)
-        mov_frame = (mov_frame / np.max(mov_frame) * 255).astype(np.uint8)
+        # Normalize the frames to the same range for proper comparison if needed.
+        # NORM_INF scales each frame so that its maximum maps to 255 and casts to uint8 in a
+        # single pass.
+        hdf5_frame = cv2.normalize(hdf5_frame, None, 255, 0, cv2.NORM_INF, cv2.CV_8U)
+        mov_frame = cv2.normalize(mov_frame, None, 255, 0, cv2.NORM_INF, cv2.CV_8U)
 
         # Create a new image by concatenating both frames side by side
         combined_image = np.hstack((hdf5_frame, mov_frame))
@@ -10,15 +10,33 @@ import tifffile
 import zarr
 from tqdm import tqdm
 
+from utils import map_in_process_pool, write_frames_in_background
+
 XY_DOWNSAMPLE_FACTOR = 1
 T_DOWNSAMPLE_FACTOR = 1
 
+# The number of frames to read from the ND2 file with each dask computation.
+FRAME_BATCH_SIZE = 32
+
 
 @click.group()
 def cli():
     pass
 
 
+def _iter_frames(raw_image, batch_size=FRAME_BATCH_SIZE):
+    """
+    Yields the frames (slices along the first axis) of an image one at a time as numpy arrays.
+
+    The frames are computed in batches of `batch_size` frames, so that a dask-backed image is read
+    with one dask computation per batch rather than one per frame. This amortizes the dask
+    scheduler overhead; the ND2 reader still reads the frames within a batch one at a time.
+    """
+    for batch_start in range(0, raw_image.shape[0], batch_size):
+        batch = np.asarray(raw_image[batch_start : batch_start + batch_size])
+        yield from batch
+
+
 @click.option("--nd2-path", type=Path, help="Path to the nd2 file")
 @click.option("--output-path", type=Path, help="Path to the output file")
 @cli.command()
@@ -34,24 +52,35 @@ def _convert_file(nd2_path: Path, output_path: Path) -> None:
     """
     raw_image = nd2.imread(nd2_path, dask=True)
 
-    # The raw image has dimensions (T, X, Y).
-    raw_image = np.asarray(raw_image)[
-        ::T_DOWNSAMPLE_FACTOR, ::XY_DOWNSAMPLE_FACTOR, ::XY_DOWNSAMPLE_FACTOR
-    ]
+    # The raw image has dimensions (T, X, Y). It is a lazy dask array, so downsampling it here
+    # does not read any data; frames are only read from the ND2 file when they are needed.
+    raw_image = raw_image[::T_DOWNSAMPLE_FACTOR, ::XY_DOWNSAMPLE_FACTOR, ::XY_DOWNSAMPLE_FACTOR]
 
     file_format = output_path.suffix[1:].lower()
     if file_format == "mov":
         # We use an arbitrary FPS of 10 that is suitable for visual inspection.
+        if raw_image.ndim != 3:
+            raise ValueError(f"Image has incorrect dimensions {raw_image.shape} for MOV output.")
         with imageio.get_writer(str(output_path), fps=10, quality=7, format="FFMPEG") as writer:
-            num_frames = raw_image.shape[0]
-            for frame_idx in tqdm(range(num_frames)):
-                frame = np.asarray(raw_image[frame_idx])
-                if frame.ndim != 2:
-                    raise ValueError(f"Frame {frame_idx} has incorrect dimensions.")
-                writer.append_data(frame)
+            frames = tqdm(_iter_frames(raw_image), total=raw_image.shape[0])
+            write_frames_in_background(writer, frames)
 
     elif file_format == "tiff":
-        tifffile.imwrite(output_path, raw_image)
+        if raw_image.ndim == 3:
+            # Passing an iterator of frames writes them one at a time as pages of a single series.
+            # tifffile cannot infer the data size from an iterator, so we always write a BigTIFF
+            # to support stacks larger than 4 GB.
+            tifffile.imwrite(
+                output_path,
+                _iter_frames(raw_image),
+                shape=raw_image.shape,
+                dtype=raw_image.dtype,
+                bigtiff=True,
+            )
+        else:
+            # Images with extra dimensions (e.g. channels) do not map to one page per frame,
+            # so they are written in memory and tifffile determines their page layout.
+            tifffile.imwrite(output_path, raw_image.compute())
 
     elif file_format == "zarr":
         # Zarr "files" are actually directories, so we need to delete the existing directory
@@ -60,15 +89,21 @@ def _convert_file(nd2_path: Path, output_path: Path) -> None:
         output_path.mkdir(exist_ok=True, parents=True)
 
         xy_size = raw_image.shape[1]
-        zarr_array = zarr.array(
-            raw_image,
+        zarr_array = zarr.open(
+            str(output_path),
+            mode="w",
+            shape=raw_image.shape,
+            dtype=raw_image.dtype,
             compressor=zarr.Blosc(cname="zstd", clevel=3, shuffle=numcodecs.Blosc.BITSHUFFLE),
             # We use a chunksize that spans multiple frames in an attempt to optimize
             # the compression ratio (since adjacent frames are highly correlated).
             chunks=(10, xy_size, xy_size),
         )
+        # Rechunking the dask array to match the zarr chunks means that each zarr chunk is read,
+        # compressed, and written to disk by a single dask task, so the chunks are streamed to
+        # the store in parallel without ever holding the full image in memory.
+        raw_image.rechunk(zarr_array.chunks).to_zarr(zarr_array)
         click.echo(zarr_array.info)
-        zarr.save(str(output_path), zarr_array)
 
     else:
         raise ValueError(f"Unsupported file format: {file_format}")
@@ -89,7 +124,10 @@ def convert_dir(input_dirpath: Path, output_dirpath: Path, file_format: str) ->
     output_dirpath: Path to the output directory in which the converted files will be saved
         in the same subdirectory structure as the input directory.
     file_format: Output file format.
+
+    The files are converted in parallel in a pool of processes.
     """
+    nd2_filepaths, output_filepaths = [], []
     for dirpath, _, filenames in input_dirpath.walk():
         for filename in filenames:
             if filename.endswith(".nd2"):
@@ -104,7 +142,10 @@ def convert_dir(input_dirpath: Path, output_dirpath: Path, file_format: str) ->
                     continue
 
                 output_filepath.parent.mkdir(exist_ok=True, parents=True)
-                _convert_file(nd2_filepath, output_filepath)
+                nd2_filepaths.append(nd2_filepath)
+                output_filepaths.append(output_filepath)
+
+    map_in_process_pool(_convert_file, nd2_filepaths, output_filepaths)
 
 
 if __name__ == "__main__":
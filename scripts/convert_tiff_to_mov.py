@@ -7,28 +7,38 @@ import imageio
 import tifffile as tiff
 from tqdm import tqdm
 
+from utils import map_in_process_pool, write_frames_in_background
+
 
 @click.group()
 def cli():
     pass
 
 
-def _convert_file(tiff_path: Path, mov_path: Path) -> None:
+def _to_uint8(frame):
     """
-    Convert a single TIFF file to MOV format using imageio with FFMPEG.
+    Rescales a frame to the full uint8 range if it is not already uint8.
     """
-    tiff_stack = tiff.imread(tiff_path)
+    if frame.dtype != "uint8":
+        frame = cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX).astype("uint8")
+    return frame
 
-    height, width = tiff_stack[0].shape
 
-    with imageio.get_writer(
-        str(mov_path), fps=24.5, codec="libx264", quality=8, format="FFMPEG"
-    ) as writer:
-        for frame in tqdm(tiff_stack, desc="Writing frames to video"):
-            if frame.dtype != "uint8":
-                frame = cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX).astype("uint8")
-
-            writer.append_data(frame)
+def _convert_file(tiff_path: Path, mov_path: Path) -> None:
+    """
+    Convert a single TIFF file to MOV format using imageio with FFMPEG.
+    """
+    with (
+        tiff.TiffFile(tiff_path) as tiff_file,
+        imageio.get_writer(
+            str(mov_path), fps=24.5, codec="libx264", quality=8, format="FFMPEG"
+        ) as writer,
+    ):
+        # Frames are decoded one page at a time as they are written rather than loading the
+        # whole stack up front.
+        pages = tqdm(tiff_file.pages, desc="Writing frames to video")
+        frames = (_to_uint8(page.asarray()) for page in pages)
+        write_frames_in_background(writer, frames)
 
     click.echo(f"Converted {tiff_path} to {mov_path}.")
 
@@ -59,7 +69,9 @@ def convert_dir(input_dirpath: Path, output_dirpath: Path, filter_string: str) -
     """
     Converts all TIFF files in a directory to MOV format, preserving its directory structure.
     Only files containing the specified filter string in their filenames are converted.
+    The files are converted in parallel in a pool of processes.
     """
+    tiff_paths, mov_paths = [], []
     for dirpath, _, filenames in os.walk(input_dirpath):
         dirpath = Path(dirpath)
         for filename in filenames:
@@ -72,7 +84,10 @@ def convert_dir(input_dirpath: Path, output_dirpath: Path, filter_string: str) -
                     continue
 
                 mov_path.parent.mkdir(parents=True, exist_ok=True)
-                _convert_file(tiff_path, mov_path)
+                tiff_paths.append(tiff_path)
+                mov_paths.append(mov_path)
+
+    map_in_process_pool(_convert_file, tiff_paths, mov_paths)
 
 
 if __name__ == "__main__":
@@ -16,12 +16,13 @@ def make_projection_from_tiff(tiff_path, output_path):
     """
     tiff_file_path = pathlib.Path(tiff_path).absolute()
 
-    images = tifffile.imread(str(tiff_file_path))
-
-    if images.ndim == 2:
-        images = images[np.newaxis, ...]
-
-    min_proj = np.min(images, axis=0)
+    # Fold the pages into a running minimum one at a time, so that only a single frame needs to be
+    # held in memory in addition to the projection.
+    with tifffile.TiffFile(str(tiff_file_path)) as tiff_file:
+        pages = iter(tiff_file.pages)
+        min_proj = next(pages).asarray()
+        for page in pages:
+            np.minimum(min_proj, page.asarray(), out=min_proj)
 
     scaled_image = skimage.util.img_as_ubyte(min_proj)
 
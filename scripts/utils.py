@@ -0,0 +1,54 @@
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+def write_frames_in_background(writer, frames, max_queued_frames=16):
+    """
+    Appends frames to an imageio writer from a background thread.
+
+    Frames are handed to the writer thread through a bounded queue, so reading or decoding the
+    next frames overlaps with encoding the previous ones, while at most `max_queued_frames`
+    frames are held in memory at once. Errors raised by the writer are re-raised in the calling
+    thread.
+    """
+    frame_queue = queue.Queue(maxsize=max_queued_frames)
+    errors = []
+
+    def _write_frames():
+        while (frame := frame_queue.get()) is not None:
+            # Keep draining the queue after an error so that the caller never blocks on `put`.
+            if errors:
+                continue
+            try:
+                writer.append_data(frame)
+            except Exception as error:
+                errors.append(error)
+
+    writer_thread = threading.Thread(target=_write_frames)
+    writer_thread.start()
+    try:
+        for frame in frames:
+            if errors:
+                break
+            frame_queue.put(frame)
+    finally:
+        frame_queue.put(None)
+        writer_thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+def map_in_process_pool(func, *iterables, max_workers=None):
+    """
+    Calls `func` on each set of arguments from `iterables` in a pool of processes and returns the
+    results in order. Exceptions raised by `func` are re-raised in the calling process.
+
+    By default, half of the available CPUs are used, because the per-file work that this is used
+    for is itself multithreaded (ffmpeg encoding, zarr compression, the DoG filter thread pool).
+    """
+    max_workers = max_workers or max(1, os.cpu_count() // 2)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, *iterables))